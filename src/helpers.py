@@ -29,9 +29,16 @@ def fix_mnemonic(phrase):
     return bip39.mnemonic_from_bytes(entropy)
 
 
+# cache of sha256(tag) - tags are constant strings,
+# so we don't need to hash them on every call
+_TAG_HASHES = {}
+
 def tagged_hash(tag: str, data: bytes) -> bytes:
     """BIP-Schnorr tag-specific key derivation"""
-    hashtag = hashlib.sha256(tag.encode()).digest()
+    hashtag = _TAG_HASHES.get(tag)
+    if hashtag is None:
+        hashtag = hashlib.sha256(tag.encode()).digest()
+        _TAG_HASHES[tag] = hashtag
     return hashlib.sha256(hashtag + hashtag + data).digest()
 
 
@@ -105,6 +112,181 @@ def aead_decrypt(ciphertext: bytes, key: bytes) -> tuple:
     return adata, decrypt(ct, aes_key)
 
 
+# size of the chunks processed by streaming aead functions,
+# should be a multiple of AES_BLOCK
+AEAD_CHUNK = 512
+MAC_SIZE = 32
+# size of the writes to the file in streaming functions,
+# multiple of SD card sector size to avoid read-modify-write
+WRITE_BUFFER = 4096
+
+
+class BufferedWriter:
+    """
+    Accumulates written data and passes it to the file
+    in full buffer-sized blocks.
+    The buffer is allocated only when data doesn't fit in one block,
+    small payloads are written with a single call in flush().
+    Call flush() at the end to write the rest.
+    """
+
+    def __init__(self, fout, size=WRITE_BUFFER):
+        self.fout = fout
+        self.size = size
+        self.buf = None
+        # small pieces written before the buffer is allocated
+        self.parts = []
+        self.pos = 0
+
+    def write(self, data):
+        if self.buf is None:
+            if self.pos + len(data) < self.size:
+                self.parts.append(bytes(data))
+                self.pos += len(data)
+                return len(data)
+            # first full block - move pending pieces to the buffer
+            self.buf = bytearray(self.size)
+            pos = 0
+            for part in self.parts:
+                self.buf[pos:pos+len(part)] = part
+                pos += len(part)
+            self.parts = None
+        i = 0
+        while i < len(data):
+            n = min(len(data) - i, self.size - self.pos)
+            self.buf[self.pos:self.pos+n] = data[i:i+n]
+            self.pos += n
+            i += n
+            if self.pos == self.size:
+                self.fout.write(self.buf)
+                self.pos = 0
+        return len(data)
+
+    def flush(self):
+        if self.pos == 0:
+            return
+        if self.buf is None:
+            self.fout.write(b"".join(self.parts))
+            self.parts = []
+        else:
+            self.fout.write(memoryview(self.buf)[:self.pos])
+        self.pos = 0
+
+
+def aead_encrypt_stream(key: bytes, adata: bytes, fin, fout, h=None):
+    """
+    Streaming version of aead_encrypt.
+    Reads plaintext from fin and writes encrypted data to fout
+    in WRITE_BUFFER-sized blocks, output format is the same as in aead_encrypt.
+    If hash object h is passed it is updated with all written bytes.
+    This is a generator - it yields after every processed chunk
+    so the caller can pass control to other tasks (i.e. GUI).
+    """
+    aes_key = tagged_hash("aes", key)
+    mac = hmac.new(tagged_hash("hmac", key), digestmod="sha256")
+    out = BufferedWriter(fout)
+
+    def write(data):
+        mac.update(data)
+        if h is not None:
+            h.update(data)
+        out.write(data)
+
+    write(compact.to_bytes(len(adata)) + adata)
+    crypto = None
+    buf = b""
+    while True:
+        chunk = fin.read(AEAD_CHUNK)
+        if not chunk:
+            break
+        # init cipher on first chunk - no ct if plaintext is empty
+        if crypto is None:
+            iv = rng.get_random_bytes(IV_SIZE)
+            crypto = aes(aes_key, AES_CBC, iv)
+            write(iv)
+        buf += chunk
+        # encrypt all complete blocks, keep the rest
+        n = len(buf) - len(buf) % AES_BLOCK
+        if n > 0:
+            write(crypto.encrypt(buf[:n]))
+            buf = buf[n:]
+        yield
+    if crypto is not None:
+        # bit padding (0x80...)
+        buf += b"\x80"
+        if len(buf) % AES_BLOCK != 0:
+            buf += b"\x00" * (AES_BLOCK - (len(buf) % AES_BLOCK))
+        write(crypto.encrypt(buf))
+    d = mac.digest()
+    if h is not None:
+        h.update(d)
+    out.write(d)
+    out.flush()
+
+
+class _MACReader:
+    """Passes everything read from the stream to the mac object"""
+
+    def __init__(self, fin, mac):
+        self.fin = fin
+        self.mac = mac
+        self.count = 0
+
+    def read(self, n):
+        data = self.fin.read(n)
+        self.mac.update(data)
+        self.count += len(data)
+        return data
+
+
+def aead_decrypt_stream(fin, fout, key: bytes) -> bytes:
+    """
+    Streaming version of aead_decrypt.
+    Reads fin only once, verifying MAC and decrypting at the same time.
+    Plaintext is kept in an internal buffer and written to fout
+    only after MAC is verified. fin should be seekable.
+    Returns associated data.
+    """
+    size = fin.seek(0, 2)
+    fin.seek(0)
+    if size < MAC_SIZE + 1:
+        raise Exception("Invalid length")
+    mac = hmac.new(tagged_hash("hmac", key), digestmod="sha256")
+    r = _MACReader(fin, mac)
+    l = compact.read_from(r)
+    adata = r.read(l)
+    left = size - MAC_SIZE - r.count
+    if len(adata) != l or left < 0:
+        raise Exception("Invalid length")
+    plain = None
+    if left > 0:
+        if left < IV_SIZE + AES_BLOCK or (left - IV_SIZE) % AES_BLOCK != 0:
+            raise Exception("Invalid length")
+        crypto = aes(tagged_hash("aes", key), AES_CBC, r.read(IV_SIZE))
+        left -= IV_SIZE
+        # plaintext size is known, so decrypt in place without extra copies
+        plain = bytearray(left)
+        pos = 0
+        while pos < len(plain):
+            chunk = r.read(min(AEAD_CHUNK, len(plain) - pos))
+            if len(chunk) == 0 or len(chunk) % AES_BLOCK != 0:
+                raise Exception("Invalid length")
+            plain[pos:pos+len(chunk)] = crypto.decrypt(chunk)
+            pos += len(chunk)
+    if fin.read(MAC_SIZE) != mac.digest():
+        raise Exception("Invalid HMAC")
+    # authenticated - now we can check padding and release the plaintext
+    if plain is not None:
+        # padding is 0x80 followed by up to AES_BLOCK-1 zeroes
+        idx = len(plain) - 1
+        while idx > len(plain) - AES_BLOCK and plain[idx] == 0:
+            idx -= 1
+        if plain[idx] != 0x80:
+            raise Exception("Invalid padding")
+        fout.write(memoryview(plain)[:idx])
+    return adata
+
+
 def load_apps(module="apps", whitelist=None, blacklist=None):
     mod = __import__(module)
     mods = mod.__all__
@@ -4,10 +4,11 @@ import platform
 from rng import get_random_bytes
 import hashlib
 import hmac
+import asyncio
 from bitcoin import ec, bip39, bip32
 from bitcoin.liquid import slip77
 from bitcoin.transaction import SIGHASH
-from helpers import aead_encrypt, aead_decrypt, tagged_hash
+from helpers import aead_encrypt, aead_decrypt, aead_encrypt_stream, aead_decrypt_stream, tagged_hash
 import secp256k1
 from gui.screens import Alert, PinScreen, MnemonicScreen, Prompt
 from binascii import hexlify
@@ -111,6 +112,35 @@ class RAMKeyStore(KeyStore):
             data = f.read()
         return aead_decrypt(data, key)
 
+    async def save_aead_stream(self, path, fin, adata=b"", key=None):
+        """
+        Encrypts plaintext from fin and saves it with associated data
+        to file in chunks, returns sha256 digest of the written file.
+        Releases the event loop between chunks so GUI stays responsive.
+        """
+        if key is None:
+            key = self.idkey
+        if key is None:
+            raise KeyStoreError("Pass the key please")
+        h = hashlib.sha256()
+        with open(path, "wb") as f:
+            for _ in aead_encrypt_stream(key, adata, fin, f, h):
+                await asyncio.sleep_ms(0)
+        platform.sync()
+        return h.digest()
+
+    def load_aead_stream(self, path, fout, key=None):
+        """
+        Loads data saved with save_aead or save_aead_stream,
+        writes plaintext to fout, returns associated data
+        """
+        if key is None:
+            key = self.idkey
+        if key is None:
+            raise KeyStoreError("Pass the key please")
+        with open(path, "rb") as f:
+            return aead_decrypt_stream(f, fout, key)
+
     def get_xpub(self, path):
         if self.is_locked or self.root is None:
             raise KeyStoreError("Keystore is not ready")
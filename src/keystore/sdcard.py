@@ -7,10 +7,49 @@ from gui.screens import Alert, Progress, Menu, MnemonicScreen, InputScreen, Prom
 import asyncio
 from io import BytesIO
 from helpers import tagged_hash
-from binascii import hexlify
 import os
+import time
 from hashlib import sha256
 
+# for how long we trust the result of SD card presence check
+SD_CHECK_TTL_MS = 100
+
+# static part of the storage menu, export button is added at runtime
+STORAGE_MENU_BUTTONS = (
+    # id, text
+    (None, "Manage keys on SD card and internal flash"),
+    (0, "Save key"),
+    (1, "Load key"),
+    (2, "Delete key"),
+)
+
+
+class SDSession:
+    """
+    Keeps SD card mounted while inside the context.
+    Reentrant - nested sessions reuse the same mount,
+    so a single user flow mounts the card only once.
+    """
+
+    def __init__(self, keystore, active=True):
+        self.keystore = keystore
+        self.active = active
+
+    def __enter__(self):
+        if not self.active:
+            return self
+        if self.keystore._sd_refs == 0:
+            platform.mount_sdcard()
+        self.keystore._sd_refs += 1
+        return self
+
+    def __exit__(self, *args):
+        if not self.active:
+            return
+        self.keystore._sd_refs -= 1
+        if self.keystore._sd_refs == 0 and platform.is_sd_present():
+            platform.unmount_sdcard()
+
 
 class SDKeyStore(FlashKeyStore):
     """
@@ -30,25 +69,69 @@ class SDKeyStore(FlashKeyStore):
     storage_button = "Flash & SD card storage"
     load_button = "Load key"
 
+    def __init__(self):
+        super().__init__()
+        # cached hex id of the device used as a prefix for files on SD card,
+        # derived from the secret so reset it when the secret changes
+        self._sdid = None
+        # number of active SD sessions, see SDSession
+        self._sd_refs = 0
+        # cached result of is_key_saved, None if unknown.
+        # Reset on save, delete, secret reload and when SD card
+        # is inserted or removed. A card swapped between two
+        # is_key_saved calls is not noticed - the result stays stale
+        # until one of these events happens.
+        self._is_key_saved = None
+        self._sd_was_present = None
+        # cached result of SD card presence check, see _sd_present
+        self._sd_check_value = False
+        self._sd_check_time = None
+
+    def load_secret(self, path):
+        self._sdid = None
+        self._is_key_saved = None
+        super().load_secret(path)
+
     @property
     def sdpath(self):
         return platform.fpath("/sd")
 
+    def _sd_present(self):
+        """Checks if SD card is inserted, caches the result for SD_CHECK_TTL_MS"""
+        now = time.ticks_ms()
+        if (self._sd_check_time is None
+                or time.ticks_diff(now, self._sd_check_time) >= SD_CHECK_TTL_MS):
+            self._sd_check_value = platform.is_sd_present()
+            self._sd_check_time = now
+        return self._sd_check_value
+
+    def _sd_session(self, active=True):
+        """
+        Returns a context manager that keeps SD card mounted.
+        Does nothing if active is False (i.e. file is in internal flash).
+        """
+        return SDSession(self, active)
+
     def fileprefix(self, path):
-        if path is self.flashpath:
+        if path == self.flashpath:
             return 'reckless'
 
-        hexid = hexlify(tagged_hash("sdid", self.secret)[:4]).decode()
-        return "specterdiy%s" % hexid
+        if self._sdid is None:
+            h = tagged_hash("sdid", self.secret)
+            self._sdid = "%02x%02x%02x%02x" % (h[0], h[1], h[2], h[3])
+        return "specterdiy%s" % self._sdid
 
     async def get_keypath(self, title="Select media", only_if_exist=True, **kwargs):
         # enable / disable buttons
         enable_flash = (not only_if_exist) or platform.file_exists(self.flashpath)
         enable_sd = False
-        if platform.is_sd_present():
-            platform.mount_sdcard()
-            enable_sd = (not only_if_exist) or platform.file_exists(self.sdpath)
-            platform.unmount_sdcard()
+        if self._sd_present():
+            if not only_if_exist:
+                # no need to mount the card to enable the button
+                enable_sd = True
+            else:
+                with self._sd_session():
+                    enable_sd = platform.file_exists(self.sdpath)
         buttons = [
             (None, "Make your choice"),
             (self.flashpath, "Internal flash", enable_flash),
@@ -73,71 +156,92 @@ class SDKeyStore(FlashKeyStore):
         if filename is None:
             return
 
-        fullpath = "%s/%s.%s" % (path, self.fileprefix(path), filename)
-
-        if fullpath.startswith(self.sdpath):
-            if not platform.is_sd_present():
-                raise KeyStoreError("SD card is not present")
-            platform.mount_sdcard()
-
-        if platform.file_exists(fullpath):
-            scr = Prompt(
-                "\n\nFile already exists: %s\n" % filename,
-                "Would you like to overwrite this file?",
-            )
-            res = await self.show(scr)
-            if res is False:
-                if fullpath.startswith(self.sdpath):
-                    platform.unmount_sdcard()
-                return
-
-        self.save_aead(fullpath, plaintext=self.mnemonic.encode(),
-                       key=self.enc_secret)
-        if fullpath.startswith(self.sdpath):
-            platform.unmount_sdcard()
-        # check it's ok
-        await self.load_mnemonic(fullpath)
+        on_sd = (path == self.sdpath)
+        prefix = self.fileprefix(path)
+        name = prefix + "." + filename
+        fullpath = path + "/" + name
+
+        if on_sd and not self._sd_present():
+            raise KeyStoreError("SD card is not present")
+
+        # keep the card mounted for the whole flow including verification
+        with self._sd_session(on_sd):
+            if platform.file_exists(fullpath):
+                scr = Prompt(
+                    "\n\nFile already exists: %s\n" % filename,
+                    "Would you like to overwrite this file?",
+                )
+                res = await self.show(scr)
+                if res is False:
+                    return
+
+            digest = await self.save_aead_stream(fullpath, BytesIO(self.mnemonic.encode()),
+                                                 key=self.enc_secret)
+            # check it's ok
+            self.verify_file(fullpath, digest)
+        self._is_key_saved = True
         # return the full file name incl. prefix if saved to SD card, just the name if on flash
-        return fullpath.split("/")[-1] if fullpath.startswith(self.sdpath) else filename
+        return name if on_sd else filename
+
+    def verify_file(self, path, digest):
+        """Checks that the file content has expected sha256 digest"""
+        h = sha256()
+        with open(path, "rb") as f:
+            while True:
+                chunk = f.read(4096)
+                if not chunk:
+                    break
+                h.update(chunk)
+        if h.digest() != digest:
+            raise KeyStoreError("Failed to verify saved file")
 
     @property
     def is_key_saved(self):
-        flash_files = [
-            f[0] for f in os.ilistdir(self.flashpath)
-            if f[0].lower().startswith(self.fileprefix(self.flashpath))
-        ]
-        flash_exists = (len(flash_files) > 0)
-        if not platform.is_sd_present():
-            return flash_exists
-
-        platform.mount_sdcard()
-        sd_files = [
-            f[0] for f in os.ilistdir(self.sdpath)
-            if f[0].lower().startswith(self.fileprefix(self.sdpath))
-        ]
-        sd_exists = (len(sd_files) > 0)
-        platform.unmount_sdcard()
-        return sd_exists or flash_exists
+        sd_present = self._sd_present()
+        if sd_present != self._sd_was_present:
+            self._sd_was_present = sd_present
+            self._is_key_saved = None
+        if self._is_key_saved is None:
+            self._is_key_saved = self._check_key_saved(sd_present)
+        return self._is_key_saved
+
+    def _has_key_files(self, path):
+        prefix = self.fileprefix(path)
+        for f in os.ilistdir(path):
+            if f[0].lower().startswith(prefix):
+                return True
+        return False
+
+    def _check_key_saved(self, sd_present):
+        if self._has_key_files(self.flashpath):
+            return True
+        if not sd_present:
+            return False
+        with self._sd_session():
+            return self._has_key_files(self.sdpath)
 
     async def load_mnemonic(self, file=None):
         if self.is_locked:
             raise KeyStoreError("Keystore is locked")
 
-        if file is None:
-            file = await self.select_file()
+        # one mount for file selection and loading
+        on_sd = self._sd_present() and (file is None or file.startswith(self.sdpath))
+        with self._sd_session(on_sd):
             if file is None:
-                return False
+                file = await self.select_file()
+                if file is None:
+                    return False
 
-        if file.startswith(self.sdpath) and platform.is_sd_present():
-            platform.mount_sdcard()
+            if file.startswith(self.sdpath) and not self._sd_present():
+                raise KeyStoreError("SD card is not present")
 
-        if not platform.file_exists(file):
-            raise KeyStoreError("Key is not saved")
-        _, data = self.load_aead(file, self.enc_secret)
+            data = BytesIO()
+            try:
+                self.load_aead_stream(file, data, self.enc_secret)
+            except OSError:
+                raise KeyStoreError("Key is not saved")
 
-        if file.startswith(self.sdpath) and platform.is_sd_present():
-            platform.unmount_sdcard()
-        self.set_mnemonic(data.decode(), "")
+        self.set_mnemonic(data.getvalue().decode(), "")
         return True
 
     async def select_file(self):
@@ -148,51 +252,49 @@ class SDKeyStore(FlashKeyStore):
         buttons += self.load_files(self.flashpath)
 
         buttons += [(None, 'SD card')]
-        if platform.is_sd_present():
-            platform.mount_sdcard()
-            buttons += self.load_files(self.sdpath)
-            platform.unmount_sdcard()
+        if self._sd_present():
+            with self._sd_session():
+                buttons += self.load_files(self.sdpath)
         else:
             buttons += [(None, 'No SD card present')]
 
         return await self.show(Menu(buttons, title="Select a file", last=(None, "Cancel")))
 
     def load_files(self, path):
+        prefix = self.fileprefix(path)
+        plen = len(prefix)
+        dirpath = path + "/"
         buttons = []
-        files = [f[0] for f in os.ilistdir(path) if f[0].startswith(self.fileprefix(path))]
-
-        if len(files) == 0:
-            buttons += [(None, 'No files found')]
-        else:
-            files.sort()
-            for file in files:
-                displayname = file.replace(self.fileprefix(path), "")
-                if displayname is "":
-                    displayname = "Default"
-                else:
-                    displayname = displayname[1:]  # strip first character
-                buttons += [("%s/%s" % (path, file), displayname)]
+        for entry in os.ilistdir(path):
+            name = entry[0]
+            if len(name) < plen or name[:plen] != prefix:
+                continue
+            # strip prefix and the dot after it
+            buttons.append((dirpath + name, name[plen+1:] or "Default"))
+
+        if len(buttons) == 0:
+            return [(None, 'No files found')]
+        # all paths share the same prefix, so they are ordered by user-given name
+        buttons.sort()
         return buttons
 
     async def delete_mnemonic(self):
 
-        file = await self.select_file()
-        if file is None:
-            return False
-        # mount sd before check
-        if platform.is_sd_present() and file.startswith(self.sdpath):
-            platform.mount_sdcard()
-        if not platform.file_exists(file):
-            raise KeyStoreError("File not found.")
-        try:
-            os.remove(file)
-        except Exception as e:
-            print(e)
-            raise KeyStoreError("Failed to delete file '%s'" % file)
-        finally:
-            if platform.is_sd_present() and file.startswith(self.sdpath):
-                platform.unmount_sdcard()
-            return True
+        # one mount for file selection and removal
+        with self._sd_session(self._sd_present()):
+            file = await self.select_file()
+            if file is None:
+                return False
+            if file.startswith(self.sdpath) and not self._sd_present():
+                raise KeyStoreError("SD card is not present")
+            try:
+                os.remove(file)
+            except Exception as e:
+                print(e)
+                raise KeyStoreError("Failed to delete file '%s'" % file)
+        # other keys may still be saved - check again when needed
+        self._is_key_saved = None
+        return True
 
     async def get_input(
             self,
@@ -220,16 +322,13 @@ class SDKeyStore(FlashKeyStore):
             filename = "seed-export-%s.txt" % self.mnemonic.split()[0]
             filepath = "%s/%s" % (self.sdpath, filename)
 
-            if not platform.is_sd_present():
+            if not self._sd_present():
                 raise KeyStoreError("SD card is not present")
 
-            platform.mount_sdcard()
-
-            with open(filepath, "w") as f:
-                f.write("bip39: ")
-                f.write(self.mnemonic)
-
-            platform.unmount_sdcard()
+            with self._sd_session():
+                with open(filepath, "w") as f:
+                    f.write("bip39: ")
+                    f.write(self.mnemonic)
 
             await self.show(
                 Alert("Success!", "Your seed is exported.\n\nName: %s" % filename, button_text="OK")
@@ -238,19 +337,12 @@ class SDKeyStore(FlashKeyStore):
 
     async def storage_menu(self):
         """Manage storage"""
-        buttons = [
-            # id, text
-            (None, "Manage keys on SD card and internal flash"),
-            (0, "Save key"),
-            (1, "Load key"),
-            (2, "Delete key"),
-        ]
-
-        # disabled if SD card is not present
-        buttons.append((3, "Export recovery phrase to SD", platform.is_sd_present()))
-
         # we stay in this menu until back is pressed
         while True:
+            # disabled if SD card is not present
+            buttons = STORAGE_MENU_BUTTONS + (
+                (3, "Export recovery phrase to SD", self._sd_present()),
+            )
             # wait for menu selection
             menuitem = await self.show(Menu(buttons, last=(255, None)))
             # process the menu button:
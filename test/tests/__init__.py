@@ -2,4 +2,5 @@ from .test_keystore import *
 from .test_wallets import *
 from .test_sign import *
 from .test_revault import *
-from .test_compatibility import *
\ No newline at end of file
+from .test_compatibility import *
+from .test_aead import *
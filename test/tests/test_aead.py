@@ -0,0 +1,55 @@
+from unittest import TestCase
+from helpers import (
+    aead_encrypt, aead_decrypt,
+    aead_encrypt_stream, aead_decrypt_stream,
+)
+from io import BytesIO
+
+KEY = b"1"*32
+LENGTHS = [0, 1, 15, 16, 17, 511, 512, 513, 4095, 4096, 4097]
+ADATA = [b"", b"associated data"]
+
+def plaintext(l):
+    return bytes([i % 251 for i in range(l)])
+
+def encrypt_stream(key, adata, plain):
+    fout = BytesIO()
+    for _ in aead_encrypt_stream(key, adata, BytesIO(plain), fout):
+        pass
+    return fout.getvalue()
+
+def decrypt_stream(ct, key):
+    fout = BytesIO()
+    adata = aead_decrypt_stream(BytesIO(ct), fout, key)
+    return adata, fout.getvalue()
+
+class AEADStreamTest(TestCase):
+
+    def test_encrypt_stream(self):
+        """Streaming encryption is compatible with aead_decrypt"""
+        for adata in ADATA:
+            for l in LENGTHS:
+                plain = plaintext(l)
+                ct = encrypt_stream(KEY, adata, plain)
+                self.assertEqual(aead_decrypt(ct, KEY), (adata, plain))
+
+    def test_decrypt_stream(self):
+        """Streaming decryption is compatible with aead_encrypt"""
+        for adata in ADATA:
+            for l in LENGTHS:
+                plain = plaintext(l)
+                ct = aead_encrypt(KEY, adata, plain)
+                self.assertEqual(decrypt_stream(ct, KEY), (adata, plain))
+
+    def test_tampered(self):
+        """Any modified byte raises Invalid HMAC and releases no plaintext"""
+        ct = encrypt_stream(KEY, b"adata", plaintext(600))
+        for i in [5, 20, 300, len(ct)-40, len(ct)-1]:
+            tampered = ct[:i] + bytes([ct[i] ^ 1]) + ct[i+1:]
+            fout = BytesIO()
+            try:
+                aead_decrypt_stream(BytesIO(tampered), fout, KEY)
+                self.fail("Tampered data decrypted")
+            except Exception as e:
+                self.assertEqual(str(e), "Invalid HMAC")
+            self.assertEqual(fout.getvalue(), b"")
@@ -1,7 +1,9 @@
 from unittest import TestCase
 from keystore import FlashKeyStore
+from keystore.sdcard import SDKeyStore
 import os, json
 import platform
+import asyncio
 
 TEST_DIR = "testdir"
 
@@ -78,3 +80,112 @@ class FlashKeyStoreTest(TestCase):
         files = [f[0] for f in os.ilistdir(TEST_DIR)]
         self.assertFalse("secret" in files)
         self.assertFalse("pin" in files)
+
+
+class SDKeyStoreMock(SDKeyStore):
+    """SDKeyStore with SD card folder inside the test folder and no GUI"""
+    target = None
+    filename = None
+    selected = None
+
+    @property
+    def sdpath(self):
+        return TEST_DIR + "/sd"
+
+    async def get_keypath(self, *args, **kwargs):
+        return self.target
+
+    async def get_input(self, *args, **kwargs):
+        return self.filename
+
+    async def select_file(self):
+        return self.selected
+
+
+class SDKeyStoreTest(TestCase):
+
+    def get_keystore(self):
+        """Clean up the test folder and create fresh keystore"""
+        try:
+            platform.delete_recursively(TEST_DIR)
+            os.rmdir(TEST_DIR)
+        except:
+            pass
+        FlashKeyStore.path = TEST_DIR
+        ks = SDKeyStoreMock()
+        init_keystore(ks)
+        platform.maybe_mkdir(ks.sdpath)
+        ks.enc_secret = b"5"*32
+        ks.mnemonic = "ability "*11+"acid"
+        return ks
+
+    def save(self, ks, target, filename):
+        ks.target = target
+        ks.filename = filename
+        return asyncio.run(ks.save_mnemonic())
+
+    def delete(self, ks, path):
+        ks.selected = path
+        return asyncio.run(ks.delete_mnemonic())
+
+    def test_sd_session(self):
+        """SD session refcount returns to zero"""
+        ks = self.get_keystore()
+        with ks._sd_session():
+            with ks._sd_session():
+                self.assertEqual(ks._sd_refs, 2)
+            self.assertEqual(ks._sd_refs, 1)
+            # inactive session doesn't count
+            with ks._sd_session(False):
+                self.assertEqual(ks._sd_refs, 1)
+        self.assertEqual(ks._sd_refs, 0)
+
+        def early_return():
+            with ks._sd_session():
+                with ks._sd_session():
+                    return True
+        self.assertTrue(early_return())
+        self.assertEqual(ks._sd_refs, 0)
+
+        with self.assertRaises(ValueError):
+            with ks._sd_session():
+                raise ValueError()
+        self.assertEqual(ks._sd_refs, 0)
+
+    def test_is_key_saved(self):
+        """is_key_saved follows save, delete and secret change"""
+        ks = self.get_keystore()
+        self.assertFalse(ks.is_key_saved)
+        name = self.save(ks, ks.sdpath, "test")
+        self.assertEqual(name, ks.fileprefix(ks.sdpath) + ".test")
+        self.assertEqual(ks._sd_refs, 0)
+        self.assertTrue(ks.is_key_saved)
+        self.assertTrue(self.delete(ks, ks.sdpath + "/" + name))
+        self.assertEqual(ks._sd_refs, 0)
+        self.assertFalse(ks.is_key_saved)
+        # flash
+        self.assertEqual(self.save(ks, ks.flashpath, "test"), "test")
+        self.assertTrue(ks.is_key_saved)
+        self.delete(ks, ks.flashpath + "/reckless.test")
+        self.assertFalse(ks.is_key_saved)
+        # key on SD card is not visible with a different secret
+        self.save(ks, ks.sdpath, "test")
+        self.assertTrue(ks.is_key_saved)
+        with open(TEST_DIR + "/secret", "wb") as f:
+            f.write(b"7"*32)
+        ks.load_secret(TEST_DIR)
+        self.assertFalse(ks.is_key_saved)
+
+    def test_load_files(self):
+        """Only files with our prefix are listed, sorted by name"""
+        ks = self.get_keystore()
+        prefix = ks.fileprefix(ks.sdpath)
+        for name in [prefix + ".b", "specterdiy00000000.c", prefix, prefix + ".a", "other"]:
+            with open(ks.sdpath + "/" + name, "wb") as f:
+                f.write(b"1")
+        self.assertEqual(ks.load_files(ks.sdpath), [
+            (ks.sdpath + "/" + prefix, "Default"),
+            (ks.sdpath + "/" + prefix + ".a", "a"),
+            (ks.sdpath + "/" + prefix + ".b", "b"),
+        ])
+        self.assertEqual(ks.load_files(ks.flashpath), [(None, "No files found")])